@@ -1,11 +1,60 @@
+from django.conf import settings
 from django.contrib import messages
-from django.contrib.admin import register
+from django.contrib.admin import action, register
+from django.contrib.admin.views.main import ChangeList
 from django.contrib.auth.admin import UserAdmin as ModelAdmin
+from django.db.models import F
+from django.db.models.functions import Now
 from django.shortcuts import redirect
 from django.urls import path, reverse
 from django.utils.html import format_html
 
 from .models import User
+from .notifications import enqueue_premium_promotion_notification
+
+
+class UserChangeList(ChangeList):
+    def get_queryset(self, request, exclude_parameters=None):
+        # Only fetch the columns shown on the list page
+        field_names = {field.name for field in self.model._meta.concrete_fields}
+        return (
+            super()
+            .get_queryset(request, exclude_parameters)
+            .only(*(name for name in self.list_display if name in field_names))
+        )
+
+
+@action(description="Reset remaining download size to daily maximum")
+def reset_download_max_size(modeladmin, request, queryset):
+    updated_count = queryset.update(
+        remaining_download_size=F("maximum_download_size_per_day"),
+        date_update=Now(),
+    )
+
+    modeladmin.message_user(
+        request,
+        f"Successfully reset remaining download size for {updated_count} user(s) to their maximum daily limit.",
+    )
+
+
+@action(description="Promote selected users to premium")
+def grant_premium(modeladmin, request, queryset):
+    users = list(queryset.filter(is_premium=False).values_list("pk", "telegram_chat_id"))
+    updated_count = User.objects.filter(pk__in=[pk for pk, _ in users]).update(
+        is_premium=True,
+        premium_requested=False,
+        maximum_download_size_per_day=settings.MAX_PREMIUM_DOWNLOAD_SIZE,
+        remaining_download_size=settings.MAX_PREMIUM_DOWNLOAD_SIZE,
+        date_update=Now(),
+    )
+    for _, chat_id in users:
+        if chat_id:
+            enqueue_premium_promotion_notification(chat_id)
+
+    modeladmin.message_user(
+        request,
+        f"Successfully promoted {updated_count} user(s) to premium.",
+    )
 
 
 @register(User)
@@ -21,13 +70,17 @@ class UserAdmin(ModelAdmin):
         "date_update",
         "is_verified",
     )
-    search_fields = ("username", "phone_number", "telegram_id" )
+    search_fields = ("username", "telegram_id")
+    search_help_text = "Search by Telegram user ID or Telegram username"
     ordering = ("-date_create",)
+    # Skip the unfiltered COUNT(*) on every page load
+    show_full_result_count = False
+    list_per_page = 50
     list_filter = ("is_staff", "is_active", "is_premium", "premium_requested")
     readonly_fields = ("date_create", "date_update", "premium_request_date", "reset_download_size_button")
     fieldsets = (
         (None, {"fields": ("username", "password")}),
-        ("Personal info", {"fields": ("first_name", "last_name", "telegram_id")}),
+        ("Personal info", {"fields": ("first_name", "last_name", "telegram_id", "telegram_chat_id", "language")}),
         (
             ("Limits"),
             {
@@ -70,6 +123,9 @@ class UserAdmin(ModelAdmin):
         ),
     )
 
+    def get_changelist(self, request, **kwargs):
+        return UserChangeList
+
     def reset_download_size_button(self, obj):
         """Display a reset button for individual user"""
         if obj.pk:  # Only show for existing users
@@ -93,36 +149,18 @@ class UserAdmin(ModelAdmin):
 
     def reset_individual_download(self, request, user_id):
         """Reset download limit for individual user"""
-        try:
-            user = User.objects.get(pk=user_id)
-            user.remaining_download_size = user.maximum_download_size_per_day
-            user.save(update_fields=["remaining_download_size"])
-
+        updated_count = User.objects.filter(pk=user_id).update(
+            remaining_download_size=F("maximum_download_size_per_day"),
+            date_update=Now(),
+        )
+        if updated_count:
             messages.success(
                 request,
-                f"Successfully reset download limit for user '{user.username}' "
-                f"to {user.maximum_download_size_per_day} MB",
+                "Successfully reset download limit to the user's daily maximum",
             )
-        except User.DoesNotExist:
+        else:
             messages.error(request, "User not found")
 
         return redirect("admin:account_user_change", user_id)
 
-    def reset_download_max_size(self, request, queryset):
-        updated_count = 0
-        for user in queryset:
-            user.remaining_download_size = user.maximum_downloads_per_day
-            user.save(update_fields=["remaining_download_size"])
-            updated_count += 1
-
-        self.message_user(
-            request,
-            f"Successfully reset remaining download size for {updated_count} user(s) to their maximum daily limit.",
-        )
-
-    reset_download_max_size.short_description = (
-        "Reset remaining download size to daily maximum"
-    )
-
-    # Add the action to the admin
-    actions = ["reset_download_max_size"]
+    actions = [reset_download_max_size, grant_premium]
@@ -0,0 +1,38 @@
+# Generated by Django 5.2.4 on 2026-10-16 12:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("account", "0006_user_premium_request_date_user_premium_requested"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="user",
+            name="date_create",
+            field=models.DateTimeField(
+                auto_now_add=True, db_index=True, verbose_name="date create"
+            ),
+        ),
+        migrations.AlterField(
+            model_name="user",
+            name="telegram_id",
+            field=models.CharField(
+                blank=True,
+                db_index=True,
+                help_text="identifier for the user in Telegram.",
+                max_length=50,
+                null=True,
+                verbose_name="telegram ID",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="user",
+            index=models.Index(
+                fields=["is_premium", "premium_requested"],
+                name="account_user_premium_idx",
+            ),
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 5.2.4 on 2026-10-16 12:30
+
+from django.db import migrations, models
+
+
+def backfill_telegram_chat_id(apps, schema_editor):
+    User = apps.get_model("account", "User")
+    # Bot users are stored with their numeric Telegram ID as username
+    users = []
+    for user in User.objects.only("pk", "username").iterator():
+        if user.username.isdigit():
+            user.telegram_chat_id = int(user.username)
+            users.append(user)
+    User.objects.bulk_update(users, ["telegram_chat_id"], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("account", "0007_alter_user_date_create_alter_user_telegram_id_and_more"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="user",
+            name="telegram_chat_id",
+            field=models.BigIntegerField(
+                blank=True,
+                help_text="Numeric Telegram chat ID used to message the user.",
+                null=True,
+                unique=True,
+                verbose_name="telegram chat ID",
+            ),
+        ),
+        migrations.RunPython(backfill_telegram_chat_id, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.4 on 2026-10-16 15:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("account", "0008_user_telegram_chat_id"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="user",
+            name="language",
+            field=models.CharField(
+                blank=True,
+                help_text="Bot language chosen by the user, detected from Telegram when empty.",
+                max_length=10,
+                null=True,
+                verbose_name="language",
+            ),
+        ),
+    ]
@@ -44,6 +44,14 @@ class User(AbstractBaseUser, PermissionsMixin):
         help_text=_("identifier for the user in Telegram."),
         null=True,
         blank=True,
+        db_index=True,
+    )
+    telegram_chat_id = models.BigIntegerField(
+        unique=True,
+        verbose_name=_("telegram chat ID"),
+        help_text=_("Numeric Telegram chat ID used to message the user."),
+        null=True,
+        blank=True,
     )
     first_name = models.CharField(
         max_length=30,
@@ -59,6 +67,13 @@ class User(AbstractBaseUser, PermissionsMixin):
         null=True,
         blank=True,
     )
+    language = models.CharField(
+        max_length=10,
+        verbose_name=_("language"),
+        help_text=_("Bot language chosen by the user, detected from Telegram when empty."),
+        null=True,
+        blank=True,
+    )
     remaining_download_size = models.IntegerField(
         default=20,
         verbose_name=_("remaining download size"),
@@ -96,6 +111,7 @@ class User(AbstractBaseUser, PermissionsMixin):
     )
     date_create = models.DateTimeField(
         auto_now_add=True,
+        db_index=True,
         verbose_name=_("date create"),
     )
     is_active = models.BooleanField(
@@ -121,10 +137,25 @@ class User(AbstractBaseUser, PermissionsMixin):
     USERNAME_FIELD = "username"
     REQUIRED_FIELDS = []
 
+    # is_premium as loaded from the database, used to detect promotions
+    _was_premium = None
+
     class Meta:
         verbose_name = _("user")
         verbose_name_plural = _("users")
         ordering = ["-date_create"]
+        indexes = [
+            models.Index(
+                fields=["is_premium", "premium_requested"],
+                name="account_user_premium_idx",
+            ),
+        ]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._was_premium = instance.__dict__.get("is_premium")
+        return instance
 
     def has_perm(self, perm, obj=None):
         return self.is_superuser
@@ -0,0 +1,139 @@
+import logging
+import queue
+import threading
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+PROMOTION_MESSAGE = (
+    "🎉 **Congratulations!**\n\n"
+    "✅ You have been promoted to **Premium**!\n\n"
+    "🌟 **Premium Features Activated:**\n"
+    f"• Unlimited daily downloads (up to {settings.MAX_PREMIUM_DOWNLOAD_SIZE}MB per day)\n"
+    "• Priority processing\n"
+    "• Access to all file formats\n"
+    "• Enhanced download speeds\n\n"
+    "💎 Thank you for being a valued user!\n"
+    "Enjoy your premium experience! 🚀"
+)
+
+# Promotions are queued and sent by a single background worker, started on first use
+# so processes that never promote anyone don't pay for the thread or Pyrogram
+_notify_queue = queue.Queue()
+_worker_lock = threading.Lock()
+_worker_started = False
+
+def enqueue_premium_promotion_notification(chat_id):
+    """
+    Queue a premium promotion notification for the background worker
+    """
+    _start_notification_worker()
+    _notify_queue.put(chat_id)
+
+def _start_notification_worker():
+    global _worker_started
+    with _worker_lock:
+        if _worker_started:
+            return
+        threading.Thread(
+            target=_notification_worker, name="premium-notifier", daemon=True
+        ).start()
+        _worker_started = True
+
+def _notification_worker():
+    while True:
+        chat_ids = [_notify_queue.get()]
+        # Coalesce everything queued meanwhile into one sending session
+        while True:
+            try:
+                chat_ids.append(_notify_queue.get_nowait())
+            except queue.Empty:
+                break
+        try:
+            send_premium_promotion_notifications_sync(chat_ids)
+        finally:
+            for _ in chat_ids:
+                _notify_queue.task_done()
+
+def send_premium_promotion_notifications_sync(chat_ids):
+    """
+    Send notification to users that they've been promoted to premium (sync version)
+    """
+    try:
+        import asyncio
+        import sys
+
+        # Reuse the bot's connected client when the bot runs in this process
+        bot_module = sys.modules.get("apps.telegram_bot.bot")
+        app = bot_module.get_bot_app() if bot_module else None
+        if app is not None and app.is_connected:
+            loop = app.loop
+        else:
+            app, loop = _get_notifier_client()
+            if app is None:
+                return
+
+        future = asyncio.run_coroutine_threadsafe(
+            _send_promotion_messages(app, chat_ids), loop
+        )
+        future.result(timeout=30 * len(chat_ids))
+    except Exception as e:
+        logger.error(f"Failed to run premium promotion notification: {e}")
+
+# Notification client, started once and kept connected on its own event loop
+_notifier_app = None
+_notifier_loop = None
+
+def _get_notifier_client():
+    """
+    Return the (client, loop) used for notifications, starting them on first use
+    """
+    global _notifier_app, _notifier_loop
+    if _notifier_app is None:
+        import asyncio
+
+        loop = asyncio.new_event_loop()
+        threading.Thread(
+            target=loop.run_forever, name="premium-notifier-loop", daemon=True
+        ).start()
+        app = None
+        try:
+            app = asyncio.run_coroutine_threadsafe(
+                _start_notifier_client(), loop
+            ).result(timeout=60)
+        finally:
+            if app is None:
+                loop.call_soon_threadsafe(loop.stop)
+        if app is None:
+            return None, None
+        _notifier_app, _notifier_loop = app, loop
+    return _notifier_app, _notifier_loop
+
+async def _start_notifier_client():
+    from pyrogram import Client
+    from config.bot_env import ENV
+
+    if not ENV.is_configured:
+        logger.error("Bot credentials not configured for premium notification")
+        return None
+
+    # Send-only client: updates belong to the bot process
+    app = Client(
+        "premium_notification_bot",
+        api_id=ENV.api_id,
+        api_hash=ENV.api_hash,
+        bot_token=ENV.token,
+        workdir=str(settings.BASE_DIR / "data" / "pyrogram"),
+        no_updates=True,
+    )
+    await app.start()
+    return app
+
+async def _send_promotion_messages(app, chat_ids):
+    for chat_id in chat_ids:
+        try:
+            await app.send_message(chat_id, PROMOTION_MESSAGE)
+            logger.info(f"Premium promotion notification sent to user {chat_id}")
+        except Exception as e:
+            logger.error(f"Failed to send premium promotion notification to user {chat_id}: {e}")
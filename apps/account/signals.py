@@ -1,88 +1,54 @@
 import logging
-import threading
-from django.db.models.signals import post_save
+from django.conf import settings
+from django.db.models.signals import post_save, pre_save
 from django.dispatch import receiver
 from django.utils.translation import gettext_lazy as _
 
-from config import settings
 from .models import User
+from .notifications import enqueue_premium_promotion_notification
 
 logger = logging.getLogger(__name__)
 
-@receiver(post_save, sender=User)
-def notify_premium_promotion(sender, instance, created, **kwargs):
-    """
-    Signal handler to notify user when they're promoted to premium
-    """
-    if not created:  # Only for updates, not new user creation
-        # Check if the user was just promoted to premium
-        if instance.is_premium and instance.premium_requested:
-            # Update user's download limits for premium
-            User.objects.filter(pk=instance.pk).update(
-                premium_requested=False,
-                maximum_download_size_per_day=settings.MAX_PREMIUM_DOWNLOAD_SIZE,
-                remaining_download_size=settings.MAX_PREMIUM_DOWNLOAD_SIZE
-            )
-            
-            # Send notification to user in a separate thread
-            if instance.username:
-                thread = threading.Thread(
-                    target=send_premium_promotion_notification_sync,
-                    args=(instance.username,)
-                )
-                thread.daemon = True
-                thread.start()
+def _is_premium_promotion(instance, update_fields):
+    if update_fields is not None and "is_premium" not in update_fields:
+        return False
+    if instance._was_premium is None:
+        # is_premium wasn't loaded from the database, fall back to the request flag
+        return instance.is_premium and instance.premium_requested
+    return instance.is_premium and not instance._was_premium
 
-def send_premium_promotion_notification_sync(username):
+@receiver(pre_save, sender=User)
+def apply_premium_limits(sender, instance, update_fields=None, **kwargs):
     """
-    Send notification to user that they've been promoted to premium (sync version)
+    Signal handler to apply premium limits in the same save that promotes the user
     """
-    try:
-        import asyncio
-        asyncio.run(send_premium_promotion_notification(username))
-    except Exception as e:
-        logger.error(f"Failed to run premium promotion notification: {e}")
+    instance._premium_promoted = (
+        not instance._state.adding and _is_premium_promotion(instance, update_fields)
+    )
+    if instance._premium_promoted:
+        instance.premium_requested = False
+        instance.maximum_download_size_per_day = settings.MAX_PREMIUM_DOWNLOAD_SIZE
+        instance.remaining_download_size = settings.MAX_PREMIUM_DOWNLOAD_SIZE
 
-async def send_premium_promotion_notification(username):
+@receiver(post_save, sender=User)
+def notify_premium_promotion(sender, instance, created, update_fields=None, **kwargs):
     """
-    Send notification to user that they've been promoted to premium
+    Signal handler to notify user when they're promoted to premium
     """
-    try:
-        from pyrogram import Client
-        import os
-        from config.settings import BASE_DIR
-        
-        BOT_TOKEN = os.environ.get("TELEGRAM_BOT_API_TOKEN", "")
-        API_ID = int(os.environ.get("TELEGRAM_API_ID", "0"))
-        API_HASH = os.environ.get("TELEGRAM_API_HASH", "")
-        
-        if not BOT_TOKEN or not API_ID or not API_HASH:
-            logger.error("Bot credentials not configured for premium notification")
-            return
-            
-        app = Client(
-            "premium_notification_bot",
-            api_id=API_ID,
-            api_hash=API_HASH,
-            bot_token=BOT_TOKEN,
-            workdir=str(BASE_DIR / "data" / "pyrogram"),
-        )
-        
-        promotion_message = (
-            "🎉 **Congratulations!**\n\n"
-            "✅ You have been promoted to **Premium**!\n\n"
-            "🌟 **Premium Features Activated:**\n"
-            f"• Unlimited daily downloads (up to {settings.MAX_PREMIUM_DOWNLOAD_SIZE}MB per day)\n"
-            "• Priority processing\n"
-            "• Access to all file formats\n"
-            "• Enhanced download speeds\n\n"
-            "💎 Thank you for being a valued user!\n"
-            "Enjoy your premium experience! 🚀"
+    promoted = getattr(instance, "_premium_promoted", False)
+    instance._premium_promoted = False
+    instance._was_premium = instance.is_premium
+    if not promoted:
+        return
+
+    if update_fields is not None:
+        # A partial save didn't write the limits applied in pre_save
+        User.objects.filter(pk=instance.pk).update(
+            premium_requested=False,
+            maximum_download_size_per_day=settings.MAX_PREMIUM_DOWNLOAD_SIZE,
+            remaining_download_size=settings.MAX_PREMIUM_DOWNLOAD_SIZE
         )
-        
-        async with app:
-            await app.send_message(int(username), promotion_message)
-            logger.info(f"Premium promotion notification sent to user {username}")
-            
-    except Exception as e:
-        logger.error(f"Failed to send premium promotion notification to user {username}: {e}")
+
+    # Sending happens on the notification worker, the save only queues the chat ID
+    if instance.telegram_chat_id:
+        enqueue_premium_promotion_notification(instance.telegram_chat_id)
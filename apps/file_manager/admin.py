@@ -1,14 +1,28 @@
 from django.contrib import admin
+from django.contrib.admin.views.main import ChangeList
 
 from .models import FileManager
 
 
+class FileManagerChangeList(ChangeList):
+    def get_queryset(self, request, exclude_parameters=None):
+        # Only fetch the columns shown on the list page
+        return (
+            super()
+            .get_queryset(request, exclude_parameters)
+            .only("name", "user", "user__username", "created_at", "updated_at")
+        )
+
+
 @admin.register(FileManager)
 class FileManagerAdmin(admin.ModelAdmin):
     list_display = ("name", "user", "created_at", "updated_at")
-    list_filter = ("created_at", "user")
+    list_select_related = ("user",)
+    list_filter = (("created_at", admin.DateFieldListFilter), "user")
     search_fields = ("name",)
-    date_hierarchy = "created_at"
+    # Skip the unfiltered COUNT(*) on every page load
+    show_full_result_count = False
+    list_per_page = 50
     ordering = ("-created_at",)
     readonly_fields = ("created_at", "updated_at")
 
@@ -19,3 +33,9 @@ class FileManagerAdmin(admin.ModelAdmin):
             {"fields": ("created_at", "updated_at"), "classes": ("collapse",)},
         ),
     )
+
+    def get_changelist(self, request, **kwargs):
+        return FileManagerChangeList
+
+    def delete_queryset(self, request, queryset):
+        FileManager.bulk_delete(queryset)
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.4 on 2026-10-16 12:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("file_manager", "0003_alter_filemanager_name"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="filemanager",
+            name="created_at",
+            field=models.DateTimeField(auto_now_add=True, db_index=True),
+        ),
+    ]
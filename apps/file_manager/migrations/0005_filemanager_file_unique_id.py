@@ -0,0 +1,17 @@
+# Generated by Django 5.2.4 on 2026-10-16 13:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("file_manager", "0004_alter_filemanager_created_at"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="filemanager",
+            name="file_unique_id",
+            field=models.CharField(blank=True, db_index=True, max_length=100, null=True),
+        ),
+    ]
@@ -1,20 +1,26 @@
 import logging
+from contextvars import ContextVar
 
+from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.db import models
-from config.settings import MINIO_URL_EXPIRY_HOURS
 
 logger = logging.getLogger(__name__)
 User = get_user_model()
 
+# Set while bulk_delete runs, the per-row delete receiver skips the files it removes in batch
+bulk_deleting = ContextVar("file_manager_bulk_deleting", default=False)
+
 
 class FileManager(models.Model):
     name = models.CharField(max_length=255)
     file = models.FileField(upload_to="files/")
-    created_at = models.DateTimeField(auto_now_add=True)
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
     updated_at = models.DateTimeField(auto_now=True)
     file_mime_type = models.CharField(max_length=100, blank=True, null=True)
     file_size = models.PositiveIntegerField(blank=True, null=True)
+    # Telegram's content identifier, used to reuse an already stored copy
+    file_unique_id = models.CharField(max_length=100, blank=True, null=True, db_index=True)
     user = models.ForeignKey(
         User,
         on_delete=models.CASCADE,
@@ -24,36 +30,51 @@ class FileManager(models.Model):
     )
 
     @staticmethod
-    def remove_old_files():
+    def remove_old_files(batch_size=1000):
+        """Delete one batch of expired files and return the number of deleted rows"""
         from django.utils import timezone
-        from datetime import timedelta
 
-        threshold_date = timezone.now() - MINIO_URL_EXPIRY_HOURS 
-        old_files = FileManager.objects.filter(created_at__lt=threshold_date)
+        # MINIO_URL_EXPIRY_HOURS is a timedelta
+        threshold_date = timezone.now() - settings.MINIO_URL_EXPIRY_HOURS
+        old_file_ids = list(
+            FileManager.objects.filter(created_at__lt=threshold_date)
+            .order_by("id")
+            .values_list("id", flat=True)[:batch_size]
+        )
+        if not old_file_ids:
+            return 0
+        deleted_count = FileManager.bulk_delete(
+            FileManager.objects.filter(pk__in=old_file_ids)
+        )
+        logger.info(f"Deleted {deleted_count} old file(s)")
+        return deleted_count
+
+    @classmethod
+    def bulk_delete(cls, queryset):
+        """Delete the rows and their files, the files with batched MinIO requests"""
+        from minio.deleteobjects import DeleteObject
+
+        file_paths = [path for path in queryset.values_list("file", flat=True) if path]
+        token = bulk_deleting.set(True)
+        try:
+            deleted_count, _ = queryset.delete()
+        finally:
+            bulk_deleting.reset(token)
 
-        for file in old_files:
-            try:
-                file.delete()
-                logger.info(f"Deleted old file: {file.name}")
-            except Exception as e:
-                logger.error(f"Error deleting old file {file.name}: {e}")
+        if file_paths:
+            storage = cls._meta.get_field("file").storage
+            # remove_objects is lazy: the deletes are only sent while iterating the errors
+            errors = storage.client.remove_objects(
+                storage.bucket, (DeleteObject(path) for path in file_paths)
+            )
+            for error in errors:
+                logger.error(f"Error deleting file {error.name} from MinIO: {error.message}")
+
+        return deleted_count
 
     def __str__(self):
         return self.name
 
-    def delete(self, *args, **kwargs):
-        # Store file path before deletion
-        file_path = self.file.name if self.file else None
-        # Call parent delete to remove the model instance
-        super().delete(*args, **kwargs)
-        # Delete file from MinIO if it exists
-        if file_path:
-            try:
-                self.file.storage.delete(file_path)
-                logger.info(f"Deleted file {file_path} from MinIO bucket 'media'")
-            except Exception as e:
-                logger.error(f"Error deleting file {file_path} from MinIO: {e}")
-
     class Meta:
         verbose_name = "File Manager"
         verbose_name_plural = "File Managers"
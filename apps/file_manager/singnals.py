@@ -3,7 +3,7 @@ import logging
 from django.db.models.signals import post_delete
 from django.dispatch import receiver
 
-from .models import FileManager
+from .models import FileManager, bulk_deleting
 
 logger = logging.getLogger(__name__)
 
@@ -13,6 +13,9 @@ def delete_file_from_minio(sender, instance, **kwargs):
     """
     Delete the associated file from MinIO when a FileManager instance is deleted.
     """
+    if bulk_deleting.get():
+        # FileManager.bulk_delete removes the files in one batch afterwards
+        return
     if instance.file:
         try:
             # Delete the file from MinIO
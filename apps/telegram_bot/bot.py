@@ -1,10 +1,14 @@
 import asyncio
 import logging
-import os
+import re
+import signal
+import sys
+from datetime import datetime
 
 from pyrogram import filters
 from pyrogram.client import Client
 from pyrogram.handlers import CallbackQueryHandler, MessageHandler
+from pyrogram.types import Message
 
 from apps.telegram_bot.handlers.commons import (
     help_command,
@@ -16,129 +20,219 @@ from apps.telegram_bot.handlers.commons import (
 from apps.telegram_bot.handlers.documents import (
     handle_document,
     handle_download_callback,
+    start_download_workers,
+    stop_download_workers,
 )
 from apps.telegram_bot.handlers.download_link import (
     handle_video_link,
     handle_video_download_callback,
 )
-from config.settings import BASE_DIR
-
-BOT_TOKEN = os.environ.get("TELEGRAM_BOT_API_TOKEN", "")
-API_ID = int(os.environ.get("TELEGRAM_API_ID", "0"))
-API_HASH = os.environ.get("TELEGRAM_API_HASH", "")
+from config.bot_env import ENV
+from config.settings import BASE_DIR, REDIS_DB, REDIS_HOST, REDIS_PORT
 
 logger = logging.getLogger(__name__)
 
+# Handler patterns, compiled once and shared by the filters
+URL_PATTERN = re.compile(r"https?://")
+VIDEO_CALLBACK_PATTERN = re.compile(
+    r"^(download_video_|download_audio_|size_error_|cancel_video_download)"
+)
+LANGUAGE_CALLBACK_PATTERN = re.compile(r"^lang_(en|fa)$")
+DOCUMENT_CALLBACK_PATTERN = re.compile(r"^download_file_|^cancel_download(_\w+)?$")
 
-async def send_startup_notification(app):
-    """Send notification to specific user when bot starts"""
+# Run the bot's event loop on libuv when uvloop is available
+if sys.platform != "win32":
     try:
-        ADMIN_USER_ID = "103677626"
-
-        if not ADMIN_USER_ID:
-            logger.warning("⚠️ ADMIN_USER_ID not set - skipping startup notification")
-            return
-
-        startup_message = (
-            "🚀 **Bot Started Successfully!**\n\n"
-            "✅ Large File Bot is now online\n"
-            "📅 Started at: {}\n"
-            "🔧 Features available:\n"
-            "• File uploads up to 2GB\n"
-            "• Local Bot API Server\n"
-            "• Rate limiting enabled\n\n"
-            "Bot is ready to receive files! 📤"
-        )
+        import uvloop
+
+        asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+    except ImportError:
+        logger.info("uvloop not installed, using the default asyncio event loop")
+
+STARTUP_MESSAGE = (
+    "🚀 **Bot Started Successfully!**\n\n"
+    "✅ Large File Bot is now online\n"
+    "📅 Started at: {}\n"
+    "🔧 Features available:\n"
+    "• File uploads up to 2GB\n"
+    "• Local Bot API Server\n"
+    "• Rate limiting enabled\n\n"
+    "Bot is ready to receive files! 📤"
+)
+
+# Commands are matched by one filter and dispatched by name
+COMMAND_HANDLERS = {
+    "start": start_command,
+    "help": help_command,
+    "premium": premium_command,
+    "lang": language_command,
+    "language": language_command,
+}
+
+
+async def handle_command(client: Client, message: Message):
+    """Dispatch a command message to its handler"""
+    await COMMAND_HANDLERS[message.command[0]](client, message)
+
+
+# Handlers with a description for the startup log.
+# Callback handlers - order matters! More specific patterns first
+HANDLERS = [
+    (
+        MessageHandler(handle_command, filters.command(list(COMMAND_HANDLERS))),
+        f"/{', /'.join(COMMAND_HANDLERS)} commands",
+    ),
+    (MessageHandler(handle_document, filters.document), "Document handler"),
+    (
+        MessageHandler(handle_video_link, filters.text & filters.regex(URL_PATTERN)),
+        "Video link handler (URLs with http/https)",
+    ),
+    (
+        CallbackQueryHandler(
+            handle_video_download_callback, filters.regex(VIDEO_CALLBACK_PATTERN)
+        ),
+        "Video download callback handler",
+    ),
+    (
+        CallbackQueryHandler(language_callback, filters.regex(LANGUAGE_CALLBACK_PATTERN)),
+        "Language callback handler",
+    ),
+    (
+        CallbackQueryHandler(
+            handle_download_callback, filters.regex(DOCUMENT_CALLBACK_PATTERN)
+        ),
+        "Document download callback handler",
+    ),
+]
+
+
+# Client of the bot, created once per process and shared with code that needs to send messages
+_app = None
+_app_lock = asyncio.Lock()
+
+
+def get_bot_app():
+    """Return the bot client, or None if the bot hasn't been created in this process"""
+    return _app
+
+
+async def get_app():
+    """Return the bot client, creating it and registering the handlers on first use"""
+    global _app
+    async with _app_lock:
+        if _app is None:
+            if ENV.in_memory_session:
+                storage_kwargs = {
+                    "in_memory": True,
+                    "session_string": await _load_session_string(),
+                }
+            else:
+                storage_kwargs = {"workdir": str(BASE_DIR / "data" / "pyrogram")}
+            # "file_management_bot",
+            app = Client(
+                "random_hosein_bot",
+                api_id=ENV.api_id,
+                api_hash=ENV.api_hash,
+                bot_token=ENV.token,
+                # Up to 4 parallel file transfers, and wait out short FLOOD_WAITs
+                max_concurrent_transmissions=4,
+                sleep_threshold=30,
+                **storage_kwargs,
+            )
+            for handler, _ in HANDLERS:
+                app.add_handler(handler)
+            registered = "\n  ".join(description for _, description in HANDLERS)
+            logger.info("✅ Registered handlers:\n  %s", registered)
+            _app = app
+        return _app
+
+
+# Redis key of the exported session when the session is kept in memory
+SESSION_CACHE_KEY = "telegram_bot:session"
+
+
+def _session_cache():
+    import redis.asyncio as redis
+
+    return redis.Redis(host=REDIS_HOST, port=int(REDIS_PORT), db=int(REDIS_DB))
+
+
+async def _load_session_string():
+    try:
+        async with _session_cache() as cache:
+            session_string = await cache.get(SESSION_CACHE_KEY)
+    except Exception as e:
+        logger.error("❌ Failed to load bot session from Redis: %s", e)
+        return None
+    return session_string.decode() if session_string else None
+
+
+async def _save_session_string(app):
+    try:
+        session_string = await app.export_session_string()
+        async with _session_cache() as cache:
+            await cache.set(SESSION_CACHE_KEY, session_string)
+    except Exception as e:
+        logger.error("❌ Failed to save bot session to Redis: %s", e)
 
-        from datetime import datetime
 
-        formatted_message = startup_message.format(
+async def send_startup_notification(app):
+    """Send notification to specific user when bot starts"""
+    try:
+        startup_message = STARTUP_MESSAGE.format(
             datetime.now().strftime("%Y-%m-%d %H:%M:%S")
         )
-
-        # Try to send to user ID (integer)
-        try:
-            user_id = int(ADMIN_USER_ID)
-            await app.send_message(user_id, formatted_message)
-            logger.info(f"✅ Startup notification sent to user ID: {user_id}")
-        except ValueError:
-            # If not integer, try as username
-            await app.send_message(ADMIN_USER_ID, formatted_message)
-            logger.info(f"✅ Startup notification sent to username: @{ADMIN_USER_ID}")
+        await app.send_message(ENV.admin_user_id, startup_message)
+        logger.info("✅ Startup notification sent to: %s", ENV.admin_user_id)
 
     except Exception as e:
-        logger.error(f"❌ Failed to send startup notification: {e}")
+        logger.error("❌ Failed to send startup notification: %s", e)
         # Don't stop the bot if notification fails
 
 
 async def start_local_bot_async():
     """Start the bot with Local Bot API Server using Pyrogram"""
-    if not BOT_TOKEN:
-        raise ValueError("❌ TELEGRAM_BOT_API_TOKEN must be set in .env file")
-
-    if not API_ID or not API_HASH:
-        raise ValueError(
-            "❌ TELEGRAM_API_ID and TELEGRAM_API_HASH must be set in .env file"
-        )
+    ENV.validate()
 
     logger.info("🚀 Starting Large File Bot with Pyrogram and Local Bot API Server")
-    logger.info(f"🤖 Bot token: ...{BOT_TOKEN}")
-
-    logger.info(f"🔑 API ID: {API_ID}")
-
-    # "file_management_bot",
-    app = Client(
-        "random_hosein_bot",
-        api_id=API_ID,
-        api_hash=API_HASH,
-        bot_token=BOT_TOKEN,
-        workdir=str(BASE_DIR / "data" / "pyrogram"),
-    )
-
-    # Register handlers
-    logger.info("🔧 Registering bot handlers...")
-    
-    app.add_handler(MessageHandler(start_command, filters.command("start")))
-    logger.info("✅ Registered: /start command")
-    
-    app.add_handler(MessageHandler(help_command, filters.command("help")))
-    logger.info("✅ Registered: /help command")
-    
-    app.add_handler(MessageHandler(premium_command, filters.command("premium")))
-    logger.info("✅ Registered: /premium command")
-    
-    app.add_handler(
-        MessageHandler(
-            language_command, filters.command("lang") | filters.command("language")
-        )
-    )
-    logger.info("✅ Registered: /lang and /language commands")
-    
-    # Document handlers
-    app.add_handler(MessageHandler(handle_document, filters.document))
-    logger.info("✅ Registered: Document handler")
-    
-    # Video link handlers (for URLs containing http/https)
-    app.add_handler(MessageHandler(handle_video_link, filters.text & filters.regex(r'https?://')))
-    logger.info("✅ Registered: Video link handler (URLs with http/https)")
-    
-    # Callback handlers - order matters! More specific patterns first
-    app.add_handler(CallbackQueryHandler(handle_video_download_callback, filters.regex(r"^(download_video_|download_audio_|size_error_|cancel_video_download)")))
-    logger.info("✅ Registered: Video download callback handler")
-    
-    app.add_handler(CallbackQueryHandler(language_callback, filters.regex(r"^lang_")))
-    logger.info("✅ Registered: Language callback handler")
-    
-    app.add_handler(CallbackQueryHandler(handle_download_callback, filters.regex(r"^download_file_|^cancel_download$")))
-    logger.info("✅ Registered: Document download callback handler")
-
-    logger.info("✅ Bot handlers registered successfully")
+    # Only the bot ID part of the token, never the secret
+    logger.info("🤖 Bot ID: %s", ENV.token.partition(":")[0])
+
+    logger.info("🔑 API ID: %s", ENV.api_id)
+
+    app = await get_app()
     logger.info("🔄 Starting bot...")
 
     # Start the bot
-    async with app:
+    if not app.is_connected:
+        await app.start()
+    start_download_workers()
+    try:
         logger.info("✅ Bot started successfully!")
         logger.info("🔄 Bot is now polling for messages...")
-        await send_startup_notification(app)
-        # Keep the bot running
-        await asyncio.Event().wait()
+        # Don't hold up startup on the notification round-trip
+        startup_notification = asyncio.create_task(send_startup_notification(app))
+        # Keep the bot running until SIGINT/SIGTERM
+        await _wait_for_stop_signal()
+        logger.info("🛑 Stopping bot...")
+        try:
+            await asyncio.wait_for(startup_notification, timeout=2)
+        except asyncio.TimeoutError:
+            logger.warning("⚠️ Startup notification still pending at shutdown")
+    finally:
+        await stop_download_workers()
+        if ENV.in_memory_session:
+            await _save_session_string(app)
+        await app.stop()
+
+
+async def _wait_for_stop_signal():
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop_event.set)
+        except (NotImplementedError, RuntimeError, ValueError):
+            # Windows, or not the main thread (runbot --reload): wait for cancellation
+            pass
+    await stop_event.wait()
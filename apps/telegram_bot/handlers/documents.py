@@ -1,10 +1,8 @@
 import asyncio
 import logging
 import os
-from tempfile import NamedTemporaryFile
-from urllib.parse import urlsplit
+import time
 
-from asgiref.sync import sync_to_async
 from pyrogram.client import Client
 from pyrogram.enums import ParseMode
 from pyrogram.types import InlineKeyboardButton, InlineKeyboardMarkup, Message
@@ -18,43 +16,110 @@ from apps.telegram_bot.models import (
     FileTempException,
     SaveFileException,
 )
-from apps.telegram_bot.utils.utils import create_user_if_not_exists, get_user, save_file_to_db
-from config.settings import BASE_DIR, MINIO_URL_EXPIRY_HOURS
+from apps.telegram_bot.utils.utils import (
+    MAX_CONCURRENT_DOWNLOADS,
+    RATE_LIMITED_MESSAGE,
+    build_download_url,
+    charge_download_quota,
+    can_stream_to_storage,
+    copy_stored_file,
+    create_user_if_not_exists,
+    download_semaphore,
+    is_rate_limited,
+    new_temp_file,
+    save_file_to_db,
+    save_stream_to_db,
+)
+from config.settings import MINIO_URL_EXPIRY_HOURS
 
 logger = logging.getLogger(__name__)
 
-MINIO_BASE_URL = f"http://{os.environ.get('MINIO_EXTERNAL_ENDPOINT', '')}"
+# (user_id, file id) -> (expiry time, File) for documents awaiting confirmation.
+# Insertion order is expiry order, so expired entries are dropped from the front
+FILE_SET_TTL = 3600  # seconds
+FILE_SET_MAX_SIZE = 10_000
 file_set = dict()
 
+# Confirmed downloads wait here for one of the download workers, so long
+# transfers don't tie up Pyrogram's update handlers
+download_queue = asyncio.Queue(maxsize=MAX_CONCURRENT_DOWNLOADS * 4)
+_download_workers = []
+_active_downloads = 0
+
+# Message templates, filled with str.format per request
+SIZE_EXCEEDED_TEMPLATE = (
+    "⚠️ <b>File size exceeds your remaining download limit.</b>\n"
+    "<b>File size:</b> {file_size:.2f}MB\n"
+    "<b>Remaining quota:</b> {remaining_size:.2f}MB\n\n"
+    "Upgrade to premium and get up to 5GB daily download limit.\n"
+    "Use /premium command to upgrade. 🚀"
+)
+FILE_INFO_TEMPLATE = (
+    "<b>📄 File:</b> {file_name}\n"
+    "<b>📦 Size:</b> {file_size:.2f}MB\n"
+    "<b>🗃️ Remaining Quota:</b> {remaining_size:.2f}MB\n\n"
+    "👇 Click below to download:"
+)
+DOWNLOADING_TEMPLATE = (
+    "📥 <b>Downloading:</b> {file_name}\n"
+    "📦 <b>Size:</b> {file_size:.2f}MB"
+)
+WAITING_FOR_SLOT_TEMPLATE = (
+    "⏳ <b>Waiting for a free download slot:</b> {file_name}"
+)
+DOWNLOAD_COMPLETE_TEMPLATE = (
+    "✅ <b>{file_name}</b> downloaded successfully!\n"
+    "📦 <b>Size:</b> {file_size:.2f}MB\n"
+    "🗃️ <b>Remaining Quota:</b> {remaining_size:.2f}MB\n\n"
+    "<a href='{download_url}'>🔗 Download Link</a>\n\n"
+    "⏳ <i>This link will expire in {expiry_hours} hour(s).</i>"
+)
+# Link lifetime shown to users, fixed by settings
+EXPIRY_HOURS = int(MINIO_URL_EXPIRY_HOURS.total_seconds() // 3600)
+# Smaller files finish before a "downloading" edit would be seen (MB)
+PROGRESS_MESSAGE_MIN_SIZE = 10
+
 async def handle_document(client: Client, message: Message):
     user_id = message.from_user.id
-    await create_user_if_not_exists(
-        user_id,
-        message.from_user.username,
-        message.from_user.first_name,
-        message.from_user.last_name,
+    # Reject before any database work or progress message
+    if is_rate_limited(user_id):
+        await message.reply_text(RATE_LIMITED_MESSAGE, quote=True, disable_notification=True)
+        return
+    # The user bootstrap and the first reply are independent, run them together
+    user, download_message = await asyncio.gather(
+        create_user_if_not_exists(
+            user_id,
+            message.from_user.username,
+            message.from_user.first_name,
+            message.from_user.last_name,
+        ),
+        message.reply_text("📥 Preparing to download...", quote=True),
     )
-    user = await get_user(user_id)
     document = message.document
-    download_message = await message.reply_text("📥 Preparing to download...", quote=True)
-    file_properties = File(document, user, download_message, message)
-    file_set[file_properties.id] = file_properties
+    file_properties = File(
+        user=user,
+        download_message=download_message,
+        user_message=message,
+        file_name=None,
+        extra_data=None,
+        document=document,
+    )
+    _remember_file(user_id, file_properties)
 
     try:
         await _is_size_valid(file_properties)
         await _process_file(file_properties)
     except FileSizeExeption as e:
-        logger.error(f"File size error for user {user.username}: {str(e)}")
+        logger.error("File size error for user %s: %s", user.username, e)
         await download_message.edit_text(
-            f"⚠️ <b>File size exceeds your remaining download limit.</b>\n"
-            f"<b>File size:</b> {file_properties.file_size:.2f}MB\n"
-            f"<b>Remaining quota:</b> {user.remaining_download_size:.2f}MB\n\n"
-            "Upgrade to premium and get up to 5GB daily download limit.\n"
-            "Use /premium command to upgrade. 🚀",
+            SIZE_EXCEEDED_TEMPLATE.format(
+                file_size=file_properties.file_size,
+                remaining_size=user.remaining_download_size,
+            ),
             parse_mode=ParseMode.HTML
         )
     except FileException as e:
-        logger.error(f"Error processing file {document.file_name} for user {user.username}: {str(e)}")
+        logger.error("Error processing file %s for user %s: %s", document.file_name, user.username, e)
         await download_message.edit_text("❌ Error while processing your file.")
 
 async def _is_size_valid(file_properties: File):
@@ -66,20 +131,15 @@ async def _is_size_valid(file_properties: File):
         raise FileSizeExeption("File size exceeds user's remaining download size.")
 
 async def _process_file(file_properties: File):
-    file_name = file_properties.file_name
-    file_size = file_properties.file_size
-    remaining_size = file_properties.user.remaining_download_size
-
-    message_text = (
-        f"<b>📄 File:</b> {file_name}\n"
-        f"<b>📦 Size:</b> {file_size:.2f}MB\n"
-        f"<b>🗃️ Remaining Quota:</b> {remaining_size:.2f}MB\n\n"
-        "👇 Click below to download:"
+    message_text = FILE_INFO_TEMPLATE.format(
+        file_name=file_properties.file_name,
+        file_size=file_properties.file_size,
+        remaining_size=file_properties.user.remaining_download_size,
     )
 
     keyboard = InlineKeyboardMarkup([
         [InlineKeyboardButton("✅ Download File", callback_data=f"download_file_{file_properties.id}")],
-        [InlineKeyboardButton("❌ Cancel", callback_data="cancel_download")]
+        [InlineKeyboardButton("❌ Cancel", callback_data=f"cancel_download_{file_properties.id}")]
     ])
 
     await file_properties.download_message.edit_text(
@@ -90,27 +150,106 @@ async def handle_download_callback(client: Client, callback_query):
     data = callback_query.data
     if data.startswith("download_file_"):
         file_id = data.split("_")[-1]
-        file_properties = file_set.pop(file_id, 0)
-        await callback_query.answer("⬇️ Download started...", show_alert=True)
-        await _download_file(client, file_properties)
-    elif data == "cancel_download":
+        file_properties = _take_file(callback_query.from_user.id, file_id)
+        if file_properties is None:
+            await callback_query.answer("⚠️ This download is no longer available.", show_alert=True)
+            return
+        try:
+            download_queue.put_nowait((client, file_properties))
+        except asyncio.QueueFull:
+            _remember_file(callback_query.from_user.id, file_properties)
+            await callback_query.answer(
+                "⏳ Too many downloads in progress, please try again shortly.", show_alert=True
+            )
+            return
+
+        # Downloads beyond the free workers wait in line
+        position = _active_downloads + download_queue.qsize() - len(_download_workers)
+        if position > 0:
+            await callback_query.answer(f"⏳ Download queued, position {position}.", show_alert=True)
+        else:
+            await callback_query.answer("⬇️ Download started...", show_alert=True)
+    elif data.startswith("cancel_download"):
+        _take_file(callback_query.from_user.id, data.split("_")[-1])
         await callback_query.answer("❌ Download cancelled.", show_alert=True)
 
+def _remember_file(user_id, file_properties: File):
+    now = time.monotonic()
+    while file_set:
+        key, (expires_at, _) = next(iter(file_set.items()))
+        if expires_at > now and len(file_set) < FILE_SET_MAX_SIZE:
+            break
+        del file_set[key]
+    file_set[(user_id, file_properties.id)] = (now + FILE_SET_TTL, file_properties)
+
+def _take_file(user_id, file_id):
+    """Pop a pending document, None if unknown, expired or sent by another user"""
+    expires_at, file_properties = file_set.pop((user_id, file_id), (0, None))
+    if expires_at <= time.monotonic():
+        return None
+    return file_properties
+
+def start_download_workers():
+    """Start the workers that process queued downloads"""
+    if _download_workers:
+        return
+    for number in range(MAX_CONCURRENT_DOWNLOADS):
+        _download_workers.append(
+            asyncio.create_task(_download_worker(), name=f"download-worker-{number}")
+        )
+
+async def stop_download_workers():
+    """Cancel the download workers, dropping downloads still in the queue"""
+    if download_queue.qsize():
+        logger.warning("Dropping %s queued downloads", download_queue.qsize())
+    for worker in _download_workers:
+        worker.cancel()
+    await asyncio.gather(*_download_workers, return_exceptions=True)
+    _download_workers.clear()
+
+async def _download_worker():
+    global _active_downloads
+    while True:
+        client, file_properties = await download_queue.get()
+        _active_downloads += 1
+        try:
+            await _download_file(client, file_properties)
+        except Exception as e:
+            logger.error("Download worker error for %s: %s", file_properties.file_name, e)
+        finally:
+            _active_downloads -= 1
+            download_queue.task_done()
+
 async def _download_file(client, file_properties: File):
-    await file_properties.download_message.edit_text(
-        f"📥 <b>Downloading:</b> {file_properties.file_name}\n"
-        f"📦 <b>Size:</b> {file_properties.file_size:.2f}MB",
-        parse_mode=ParseMode.HTML
-    )
+    waiting_shown = download_semaphore.locked()
+    if waiting_shown:
+        # Video downloads can hold every slot, say why nothing happens yet
+        await file_properties.download_message.edit_text(
+            WAITING_FOR_SLOT_TEMPLATE.format(file_name=file_properties.file_name),
+            parse_mode=ParseMode.HTML
+        )
 
     temp_file = None
     try:
-        temp_file = await _create_temp_file()
-        await _download_file_to_temp(client, file_properties, temp_file)
-        file_saved = await _save_file_to_db(file_properties, temp_file)
+        async with download_semaphore:
+            # Small files skip this edit, unless the waiting message has to be replaced
+            if waiting_shown or file_properties.file_size >= PROGRESS_MESSAGE_MIN_SIZE:
+                await file_properties.download_message.edit_text(
+                    DOWNLOADING_TEMPLATE.format(
+                        file_name=file_properties.file_name, file_size=file_properties.file_size
+                    ),
+                    parse_mode=ParseMode.HTML
+                )
+            file_saved = await _copy_stored_file(file_properties)
+            if file_saved is None and can_stream_to_storage():
+                file_saved = await _stream_file_to_db(client, file_properties)
+            elif file_saved is None:
+                temp_file = await _create_temp_file()
+                await _download_file_to_temp(client, file_properties, temp_file)
+                file_saved = await _save_file_to_db(file_properties, temp_file)
         await _finalize_download(file_properties, file_saved)
     except Exception as e:
-        logger.error(f"Unexpected error: {str(e)}")
+        logger.error("Unexpected error: %s", e)
         await file_properties.download_message.edit_text("❌ An unexpected error occurred.")
     finally:
         if temp_file:
@@ -118,19 +257,18 @@ async def _download_file(client, file_properties: File):
 
 async def _create_temp_file():
     try:
-        os.makedirs(BASE_DIR / "data" / "temp", exist_ok=True)
-        return NamedTemporaryFile(dir=BASE_DIR / "data" / "temp", delete=False)
+        return await asyncio.to_thread(new_temp_file)
     except Exception as e:
-        logger.error(f"Temp file creation error: {str(e)}")
+        logger.error("Temp file creation error: %s", e)
         raise FileTempException("Temporary file creation failed.")
 
 async def _download_file_to_temp(client: Client, file_properties: File, temp_file):
     try:
         await client.download_media(file_properties.user_message, file_name=temp_file.name)
-        logger.info(f"{file_properties.file_name} downloaded to {temp_file.name}")
+        logger.info("%s downloaded to %s", file_properties.file_name, temp_file.name)
         return temp_file.name
     except Exception as e:
-        logger.error(f"Download error: {str(e)}")
+        logger.error("Download error: %s", e)
         raise DownloadException("Download failed.")
 
 async def _save_file_to_db(file_properties: File, temp_file):
@@ -143,39 +281,72 @@ async def _save_file_to_db(file_properties: File, temp_file):
             file_properties.document.mime_type,
         )
     except Exception as e:
-        logger.error(f"Database save error: {str(e)}")
+        logger.error("Database save error: %s", e)
         raise SaveFileException("Failed to save file to DB.")
 
+async def _copy_stored_file(file_properties: File):
+    # The same content sent again is copied inside MinIO instead of downloaded
+    try:
+        return await copy_stored_file(
+            file_properties.user,
+            file_properties.file_name,
+            file_properties.document.file_unique_id,
+            file_properties.file_size,
+            file_properties.document.mime_type,
+        )
+    except Exception as e:
+        logger.error("Stored copy lookup error: %s", e)
+        return None
+
+async def _stream_file_to_db(client: Client, file_properties: File):
+    # Upload to MinIO while downloading from Telegram, without a temp file
+    try:
+        return await save_stream_to_db(
+            file_properties.user,
+            file_properties.file_name,
+            client.stream_media(file_properties.user_message),
+            file_properties.document.file_size,
+            file_properties.file_size,
+            file_properties.document.mime_type,
+            file_unique_id=file_properties.document.file_unique_id,
+        )
+    except Exception as e:
+        logger.error("Stream upload error: %s", e)
+        raise SaveFileException("Failed to stream file to storage.")
+
 async def _finalize_download(file_properties: File, saved_file: FileManager):
     try:
         user = file_properties.user
-        user.remaining_download_size -= file_properties.file_size
-        await sync_to_async(user.save)(update_fields=["remaining_download_size"])
-
-        full_url = saved_file.file.url
-        parsed_url = urlsplit(full_url)
-        relative_path = parsed_url.path.lstrip("/") + "?" + parsed_url.query
-        expiry_hours = int(MINIO_URL_EXPIRY_HOURS.total_seconds() // 3600)
+        await charge_download_quota(user, file_properties.file_size)
 
         await file_properties.download_message.edit_text(
-            f"✅ <b>{file_properties.file_name}</b> downloaded successfully!\n"
-            f"📦 <b>Size:</b> {file_properties.file_size:.2f}MB\n"
-            f"🗃️ <b>Remaining Quota:</b> {user.remaining_download_size:.2f}MB\n\n"
-            f"<a href='{MINIO_BASE_URL}/{relative_path}'>🔗 Download Link</a>\n\n"
-            f"⏳ <i>This link will expire in {expiry_hours} hour(s).</i>",
+            DOWNLOAD_COMPLETE_TEMPLATE.format(
+                file_name=file_properties.file_name,
+                file_size=file_properties.file_size,
+                remaining_size=user.remaining_download_size,
+                download_url=build_download_url(saved_file),
+                expiry_hours=EXPIRY_HOURS,
+            ),
             parse_mode=ParseMode.HTML,
             disable_web_page_preview=True
         )
         
     except Exception as e:
-        logger.error(f"Finalize error: {str(e)}")
+        logger.error("Finalize error: %s", e)
         await file_properties.download_message.edit_text("❌ Failed to complete the download.")
 
 async def _clear_temp_file(temp_file):
     try:
-        if temp_file and os.path.exists(temp_file.name):
-            os.remove(temp_file.name)
-            logger.info(f"Temp file {temp_file.name} deleted.")
+        # Unlinking a large file can take a while, keep the lookup and removal off the event loop
+        if temp_file and await asyncio.to_thread(_remove_file, temp_file.name):
+            logger.info("Temp file %s deleted.", temp_file.name)
     except Exception as e:
-        logger.error(f"Error removing temp file: {str(e)}")
+        logger.error("Error removing temp file: %s", e)
         raise FileTempException("Failed to delete temporary file.")
+
+def _remove_file(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        return False
+    return True
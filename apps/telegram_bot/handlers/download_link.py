@@ -1,11 +1,9 @@
 import asyncio
+import functools
 import logging
 import os
-from tempfile import NamedTemporaryFile
-from urllib.parse import urlsplit
 import yt_dlp
 
-from asgiref.sync import sync_to_async
 from pyrogram.client import Client
 from pyrogram.enums import ParseMode
 from pyrogram.types import InlineKeyboardButton, InlineKeyboardMarkup, Message
@@ -20,17 +18,23 @@ from apps.telegram_bot.models import (
     SaveFileException,
 )
 from apps.telegram_bot.utils.utils import (
+    RATE_LIMITED_MESSAGE,
+    build_download_url,
+    charge_download_quota,
     create_user_if_not_exists,
-    get_user,
+    download_semaphore,
+    is_rate_limited,
+    new_temp_file,
     save_file_to_db,
 )
 from config.settings import BASE_DIR, MINIO_URL_EXPIRY_HOURS
 
 logger = logging.getLogger(__name__)
 
-MINIO_BASE_URL = f"http://{os.environ.get('MINIO_EXTERNAL_ENDPOINT', '')}"
 video_download_set = dict()
 
+COOKIES_FILE = BASE_DIR / "data" / "cookies" / "youtube_cookies.txt"
+
 
 class VideoLinkException(FileException):
     pass
@@ -47,15 +51,18 @@ class UnsupportedURLException(VideoLinkException):
 async def handle_video_link(client: Client, message: Message):
     """Main handler for video download links"""
     user_id = message.from_user.id
+    # Reject before any database work or progress message
+    if is_rate_limited(user_id):
+        await message.reply_text(RATE_LIMITED_MESSAGE, quote=True, disable_notification=True)
+        return
     logger.info(f"Processing video link request from user {user_id}")
     
-    await create_user_if_not_exists(
+    user = await create_user_if_not_exists(
         user_id,
         message.from_user.username,
         message.from_user.first_name,
         message.from_user.last_name,
     )
-    user = await get_user(user_id)
     url = message.text.strip()
     
     logger.info(f"User {user.username} requested video download from URL: {url[:50]}...")
@@ -560,25 +567,27 @@ async def _download_video(client: Client, video_properties: File, format_id: str
     
     temp_file = None
     try:
-        temp_file = await _create_temp_file()
-        downloaded_file_path = await _download_video_to_temp(url, temp_file, format_id, is_audio_only, video_properties)
-        
-        # Get actual file size
-        file_size_bytes = os.path.getsize(downloaded_file_path)
-        file_size_mb = file_size_bytes / (1024 * 1024)
-        
-        logger.info(f"Video downloaded successfully: {downloaded_file_path} ({file_size_mb:.2f}MB)")
-        
-        # Update video properties with actual file info
-        video_properties.file_size = file_size_mb
-        video_properties.file_name = os.path.basename(downloaded_file_path)
-        
-        # Check if size is valid
-        await _is_video_size_valid(video_properties)
-        
-        # Save to database
-        mime_type = "audio/mp3" if is_audio_only else "video/mp4"
-        file_saved = await _save_video_to_db(video_properties, downloaded_file_path, mime_type)
+        # Video downloads share the document download slots, extra requests wait their turn
+        async with download_semaphore:
+            temp_file = await _create_temp_file()
+            downloaded_file_path = await _download_video_to_temp(url, temp_file, format_id, is_audio_only, video_properties)
+
+            # Get actual file size
+            file_size_bytes = os.path.getsize(downloaded_file_path)
+            file_size_mb = file_size_bytes / (1024 * 1024)
+
+            logger.info(f"Video downloaded successfully: {downloaded_file_path} ({file_size_mb:.2f}MB)")
+
+            # Update video properties with actual file info
+            video_properties.file_size = file_size_mb
+            video_properties.file_name = os.path.basename(downloaded_file_path)
+
+            # Check if size is valid
+            await _is_video_size_valid(video_properties)
+
+            # Save to database
+            mime_type = "audio/mp3" if is_audio_only else "video/mp4"
+            file_saved = await _save_video_to_db(video_properties, downloaded_file_path, mime_type)
         await _finalize_video_download(video_properties, file_saved)
         
     except FileSizeExeption as e:
@@ -637,9 +646,7 @@ async def _download_video(client: Client, video_properties: File, format_id: str
 async def _create_temp_file():
     """Create temporary file for download"""
     try:
-        temp_dir = BASE_DIR / "data" / "temp"
-        os.makedirs(temp_dir, exist_ok=True)
-        return NamedTemporaryFile(dir=temp_dir, delete=False)
+        return await asyncio.to_thread(new_temp_file)
     except Exception as e:
         logger.error(f"Temp file creation error: {str(e)}")
         raise FileTempException("Temporary file creation failed.")
@@ -802,9 +809,6 @@ async def _download_video_to_temp(url: str, temp_file, format_id: str = None, is
         # Run download in executor to avoid blocking
         await asyncio.get_event_loop().run_in_executor(None, download)
         
-        # Close the temp file before searching for downloaded files
-        temp_file.close()
-        
         # Find downloaded files
         temp_dir = os.path.dirname(temp_file.name)
         temp_basename = os.path.basename(temp_file.name)
@@ -891,19 +895,16 @@ async def _finalize_video_download(video_properties: File, saved_file: FileManag
     try:
         user = video_properties.user
         
-        user.remaining_download_size -= video_properties.file_size
-        await sync_to_async(user.save)(update_fields=["remaining_download_size"])
+        await charge_download_quota(user, video_properties.file_size)
 
-        full_url = saved_file.file.url
-        parsed_url = urlsplit(full_url)
-        relative_path = parsed_url.path.lstrip("/") + "?" + parsed_url.query
+        download_url = build_download_url(saved_file)
         expiry_hours = int(MINIO_URL_EXPIRY_HOURS.total_seconds() // 3600)
 
         await video_properties.download_message.edit_text(
             f"✅ <b>{video_properties.extra_data['title']}</b> downloaded successfully!\n"
             f"📦 <b>Size:</b> {video_properties.file_size:.2f}MB\n"
             f"🗃️ <b>Remaining Quota:</b> {user.remaining_download_size:.2f}MB\n\n"
-            f"<a href='{MINIO_BASE_URL}/{relative_path}'>🔗 Download Link</a>\n\n"
+            f"<a href='{download_url}'>🔗 Download Link</a>\n\n"
             f"⏳ <i>This link will expire in {expiry_hours} hour(s).</i>",
             parse_mode=ParseMode.HTML,
             disable_web_page_preview=True
@@ -919,22 +920,25 @@ async def _finalize_video_download(video_properties: File, saved_file: FileManag
 async def _clear_temp_file(temp_file):
     """Clean up temporary files"""
     try:
-        # Remove the temp file and any files with the same base name (yt-dlp creates files with extensions)
-        base_path = temp_file.name
-        directory = os.path.dirname(base_path)
-        base_name = os.path.basename(base_path)
-        
-        for filename in os.listdir(directory):
-            if filename.startswith(base_name):
-                file_path = os.path.join(directory, filename)
-                if os.path.exists(file_path):
-                    os.remove(file_path)
-                    
+        # Unlinking large files can take a while, keep it off the event loop
+        await asyncio.to_thread(_remove_temp_files, temp_file.name)
     except Exception as e:
         logger.error(f"Error removing temp files: {str(e)}")
         raise FileTempException("Failed to delete temporary files.")
 
 
+def _remove_temp_files(base_path: str):
+    # Remove the temp file and any files with the same base name (yt-dlp creates files with extensions)
+    directory = os.path.dirname(base_path)
+    base_name = os.path.basename(base_path)
+
+    for filename in os.listdir(directory):
+        if filename.startswith(base_name):
+            file_path = os.path.join(directory, filename)
+            if os.path.exists(file_path):
+                os.remove(file_path)
+
+
 def _get_quality_display_name(format_id: str, video_properties: File) -> str:
     """Get the display name for a quality based on format ID"""
     if not format_id or not video_properties:
@@ -951,10 +955,11 @@ def _get_quality_display_name(format_id: str, video_properties: File) -> str:
     return f"Video ({format_id})"
 
 
+@functools.cache
 def _get_cookies_file_path() -> str:
-    """Get the path to the cookies file for yt-dlp"""
-    cookies_file = BASE_DIR / "data" / "cookies" / "youtube_cookies.txt"
-    
+    """Get the path to the cookies file for yt-dlp, prepared once per process"""
+    cookies_file = COOKIES_FILE
+
     # Create cookies directory if it doesn't exist
     cookies_dir = cookies_file.parent
     os.makedirs(cookies_dir, exist_ok=True)
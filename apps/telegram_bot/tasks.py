@@ -3,7 +3,8 @@ import logging
 #import magic
 from celery import shared_task
 
-from apps.telegram_bot.models import File, SaveFileException
+from apps.account.models import User
+from apps.telegram_bot.models import SaveFileException
 from apps.telegram_bot.utils.utils import save_file_to_db
 from apps.file_manager.models import FileManager
 
@@ -76,33 +77,31 @@ logger = logging.getLogger(__name__)
 #
 
 @shared_task
-def save_file_to_db_task(file_properties: File, temp_file_path: str):
+def save_file_to_db_task(user_id: int, file_name: str, temp_file_path: str, file_size: float, mime_type: str):
     """Celery task to save a file to the database.
 
     Args:
-        file_properties: File properties object containing metadata
-        temp_file_path: Path to the temporary file
+        user_id: Primary key of the owning user
+        file_name: Name to store the file under
+        temp_file_path: Path to the temporary file, on a volume shared with the bot
+        file_size: File size in MB
+        mime_type: MIME type of the file
 
     Returns:
-        FileManager: The saved file object from the database
+        int: Primary key of the saved FileManager object
     """
     try:
-        return save_file_to_db(
-            file_properties.user,
-            file_properties.file_name,
-            temp_file_path,
-            file_properties.file_size,
-            file_properties.document.mime_type,
-        )
-        logging.info(
-            f"File {file_properties.file_name} saved to database successfully."
+        user = User.objects.get(pk=user_id)
+        # save_file_to_db is wrapped for the bot's event loop, call the plain function
+        saved_file = save_file_to_db.__wrapped__(
+            user, file_name, temp_file_path, file_size, mime_type
         )
+        logger.info(f"File {file_name} saved to database successfully.")
+        return saved_file.pk
     except Exception as e:
-        logger.error(
-            f"Error saving file {file_properties.file_name} to database: {str(e)}"
-        )
+        logger.error(f"Error saving file {file_name} to database: {str(e)}")
         raise SaveFileException(
-            f"Error saving file {file_properties.file_name} to database: {str(e)}"
+            f"Error saving file {file_name} to database: {str(e)}"
         )
 
 
@@ -111,13 +110,22 @@ def example_task():
     logger.info("Example task started")
     return "Task completed!"
 
+@shared_task
+def purge_expired_files(batch_size=1000):
+    """Celery task to delete one batch of expired files, re-enqueued while a full batch was deleted."""
+    deleted_count = FileManager.remove_old_files(batch_size)
+    if deleted_count >= batch_size:
+        purge_expired_files.delay(batch_size)
+    return deleted_count
+
+
 @shared_task
 def remove_old_files_task():
     """Celery task to remove old files from the database."""
     try:
         logger.info("Removing old files from the database...")
-        FileManager.remove_old_files()
-        logger.info("Old files removed successfully.")
+        purge_expired_files()
+        logger.info("Old files removal started.")
     except Exception as e:
         logger.error(f"Error removing old files: {str(e)}")
         raise e
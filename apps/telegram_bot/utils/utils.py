@@ -1,10 +1,18 @@
+import asyncio
+import functools
 import logging
+import math
 import os
-from collections import defaultdict, deque
-from datetime import datetime, timedelta
+import queue
+import time
+from concurrent.futures import ThreadPoolExecutor
+from tempfile import NamedTemporaryFile
 
-from asgiref.sync import sync_to_async
+from django.conf import settings
 from django.core.files import File
+from django.db import close_old_connections
+from django.db.models import F
+from django.db.models.functions import Now
 
 from apps.account.models import User
 from apps.file_manager.models import FileManager
@@ -14,76 +22,150 @@ logger = logging.getLogger(__name__)
 # Rate limiting setup - Adjust these for production
 
 MAX_REQUESTS_PER_MINUTE = int(os.environ.get("BOT_MAX_REQUESTS_PER_MINUTE", "5"))
-CONCURRENT_DOWNLOADS = 0
 MAX_CONCURRENT_DOWNLOADS = int(os.environ.get("BOT_MAX_CONCURRENT_DOWNLOADS", "3"))
+# Downloads beyond the limit wait here for a free slot
+download_semaphore = asyncio.Semaphore(MAX_CONCURRENT_DOWNLOADS)
 
-# Environment variables
-base_minio_url = "http://" + os.environ.get("MINIO_EXTERNAL_ENDPOINT", "")
+UPLOAD_CHUNK_SIZE = 64 * 1024
 
-user_request_times = defaultdict(deque)
+# Blocking MinIO transfers run here, one thread per download slot. Each streamed
+# upload holds its thread while it waits for chunks, so they must not share the
+# loop's default executor with yt-dlp and file cleanup.
+_storage_executor = ThreadPoolExecutor(
+    max_workers=MAX_CONCURRENT_DOWNLOADS, thread_name_prefix="bot-storage"
+)
+
+# Downloads are staged here, created once at import
+TEMP_DIR = settings.BASE_DIR / "data" / "temp"
+TEMP_DIR.mkdir(parents=True, exist_ok=True)
+
+
+def new_temp_file():
+    """Create an empty temp file in TEMP_DIR, its handle is closed since only the name is used"""
+    temp_file = NamedTemporaryFile(dir=TEMP_DIR, delete=False)
+    temp_file.close()
+    return temp_file
+
+# Bot ORM work runs on its own threads. Each thread keeps its connection for
+# CONN_MAX_AGE seconds, close_old_connections() drops it once expired or broken.
+# SQLite allows one writer at a time, so it gets a single thread by default.
+_DEFAULT_DB_THREADS = (
+    "1" if settings.DATABASES["default"]["ENGINE"].endswith("sqlite3") else "8"
+)
+DB_THREADS = int(os.environ.get("BOT_DB_THREADS", _DEFAULT_DB_THREADS))
+_db_executor = ThreadPoolExecutor(max_workers=DB_THREADS, thread_name_prefix="bot-db")
+
+
+def db_sync_to_async(func):
+    """Like sync_to_async, but runs on the bot's dedicated database threads"""
+
+    def run(*args, **kwargs):
+        try:
+            return func(*args, **kwargs)
+        finally:
+            close_old_connections()
+
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            _db_executor, functools.partial(run, *args, **kwargs)
+        )
+
+    return wrapper
+
+
+# Public MinIO endpoint used in download links, built once
+MINIO_BASE_URL = (
+    f"{'https' if settings.MINIO_EXTERNAL_ENDPOINT_USE_HTTPS else 'http'}://"
+    f"{settings.MINIO_EXTERNAL_ENDPOINT}"
+)
+if not settings.MINIO_EXTERNAL_ENDPOINT:
+    logger.warning("MINIO_EXTERNAL_ENDPOINT is not set, download links will be broken")
+
+RATE_LIMIT_WINDOW = 60.0  # seconds
+# Each user gets a bucket of MAX_REQUESTS_PER_MINUTE tokens that refills continuously
+RATE_LIMIT_REFILL_PER_SECOND = MAX_REQUESTS_PER_MINUTE / RATE_LIMIT_WINDOW
+# Drop idle users from user_buckets every this many checks
+RATE_LIMIT_SWEEP_INTERVAL = 1024
+
+# Single reply sent instead of starting work for a rate limited user
+RATE_LIMITED_MESSAGE = "⏳ Too many requests, please wait a minute and try again."
+
+# user_id -> (tokens left, monotonic time of the last refill)
+user_buckets = {}
+_rate_limit_checks = 0
 
 
 def is_rate_limited(user_id):
     """Check if user is rate limited"""
-    now = datetime.now()
-    user_times = user_request_times[user_id]
+    global _rate_limit_checks
+    now = time.monotonic()
+
+    _rate_limit_checks += 1
+    if _rate_limit_checks % RATE_LIMIT_SWEEP_INTERVAL == 0:
+        # A user idle for a whole window has a full bucket again, same as a new one
+        for idle_user_id, (_, last) in list(user_buckets.items()):
+            if now - last >= RATE_LIMIT_WINDOW:
+                del user_buckets[idle_user_id]
 
-    # Remove old requests (older than 1 minute)
-    while user_times and user_times[0] < now - timedelta(minutes=1):
-        user_times.popleft()
+    tokens, last = user_buckets.get(user_id, (MAX_REQUESTS_PER_MINUTE, now))
+    tokens = min(
+        MAX_REQUESTS_PER_MINUTE, tokens + (now - last) * RATE_LIMIT_REFILL_PER_SECOND
+    )
 
     # Check if user exceeded limit
-    if len(user_times) >= MAX_REQUESTS_PER_MINUTE:
+    if tokens < 1:
+        user_buckets[user_id] = (tokens, now)
         return True
 
-    # Add current request
-    user_times.append(now)
+    # Count current request
+    user_buckets[user_id] = (tokens - 1, now)
     return False
 
 
-@sync_to_async
+@db_sync_to_async
 def create_user_if_not_exists(
     user_id, telegram_id=None, first_name=None, last_name=None
 ):
-    """Create user if not exists - async wrapper"""
+    """Create user if not exists and return it - async wrapper"""
     try:
-        if not User.objects.filter(username=user_id).exists():
-            User.objects.create(
-                username=user_id,
-                first_name=first_name,
-                last_name=last_name,
-                telegram_id=telegram_id,
-            )
-            return True
-        else:
-            user = User.objects.get(username=user_id)
-            if telegram_id:
-                user.telegram_id = telegram_id
-            if first_name:
-                user.first_name = first_name
-            if last_name:
-                user.last_name = last_name
-            user.save(update_fields=["telegram_id", "first_name", "last_name"])
+        # A single get_or_create avoids the race between two first messages
+        user, created = User.objects.get_or_create(
+            username=user_id,
+            defaults={
+                "telegram_chat_id": user_id,
+                "first_name": first_name,
+                "last_name": last_name,
+                "telegram_id": telegram_id,
+            },
+        )
+        if created:
+            return user
 
-        return False
+        changed = {"telegram_chat_id": user_id}
+        if telegram_id:
+            changed["telegram_id"] = telegram_id
+        if first_name:
+            changed["first_name"] = first_name
+        if last_name:
+            changed["last_name"] = last_name
+        changed = {
+            field: value
+            for field, value in changed.items()
+            if getattr(user, field) != value
+        }
+        if changed:
+            for field, value in changed.items():
+                setattr(user, field, value)
+            user.save(update_fields=list(changed))
+        return user
     except Exception as e:
-        logger.error(f"Error creating user {user_id}: {e}")
+        logger.error("Error creating user %s: %s", user_id, e)
         raise
 
 
-@sync_to_async
-def get_user(user_id):
-    """Get user by ID - async wrapper"""
-    try:
-        return User.objects.get(username=user_id)
-    except User.DoesNotExist:
-        logger.error(f"User {user_id} not found")
-        raise
-    except Exception as e:
-        logger.error(f"Error getting user {user_id}: {e}")
-        raise
-
-@sync_to_async
+@db_sync_to_async
 def save_file_to_db(user, file_name, temp_file_path, file_size, mime_type):
     try:
         # Basic validation
@@ -93,16 +175,230 @@ def save_file_to_db(user, file_name, temp_file_path, file_size, mime_type):
         if os.path.getsize(temp_file_path) == 0:
             raise ValueError(f"Temp file is empty: {temp_file_path}")
         
-        with open(temp_file_path, "rb") as temp_file:
+        mime_type = mime_type or "application/octet-stream"
+        storage = _get_minio_storage()
+        if storage is not None:
+            # Let MinIO upload straight from the path (parallel multipart) and
+            # only store the object name, instead of streaming it through File()
+            object_name = _new_object_name(storage, file_name)
+            storage.client.fput_object(
+                storage.bucket, object_name, temp_file_path, content_type=mime_type
+            )
             file_manager = FileManager.objects.create(
                 user=user,
                 name=file_name,
-                file=File(temp_file, name=file_name),
+                file=object_name,
                 file_size=file_size,
-                file_mime_type=mime_type or "application/octet-stream",
+                file_mime_type=mime_type,
             )
-            logger.info(f"File saved to database: {file_name} ({file_size:.2f}MB)")
-            return file_manager
+        else:
+            # MinIO reads the upload in 64 KiB chunks, match the read buffer to it
+            with open(temp_file_path, "rb", buffering=UPLOAD_CHUNK_SIZE) as temp_file:
+                file_manager = FileManager.objects.create(
+                    user=user,
+                    name=file_name,
+                    file=File(temp_file, name=file_name),
+                    file_size=file_size,
+                    file_mime_type=mime_type,
+                )
+        logger.info("File saved to database: %s (%.2fMB)", file_name, file_size)
+        return file_manager
     except Exception as e:
-        logger.error(f"Error saving file {file_name} to database: {e}")
+        logger.error("Error saving file %s to database: %s", file_name, e)
         raise
+
+
+@db_sync_to_async
+def charge_download_quota(user, file_size):
+    """Take file_size MB off the user's quota in a single UPDATE"""
+    # The quota is stored in whole MB, rounding up matches the old truncating save
+    charged = math.ceil(file_size)
+    # Relative to the stored value, so concurrent downloads can't overwrite each other
+    User.objects.filter(pk=user.pk).update(
+        remaining_download_size=F("remaining_download_size") - charged,
+        date_update=Now(),
+    )
+    user.remaining_download_size -= charged
+
+
+def build_download_url(saved_file):
+    """Return the public download link of a stored file"""
+    # Swap the internal scheme and host of the signed URL for the public endpoint
+    _, _, host_and_path = saved_file.file.url.partition("://")
+    _, _, path_and_query = host_and_path.partition("/")
+    return f"{MINIO_BASE_URL}/{path_and_query}"
+
+
+def _get_minio_storage():
+    storage = FileManager._meta.get_field("file").storage
+    return storage if hasattr(storage, "client") and hasattr(storage, "bucket") else None
+
+
+def _new_object_name(storage, file_name):
+    file_field = FileManager._meta.get_field("file")
+    return storage.get_available_name(file_field.generate_filename(None, file_name))
+
+
+async def _run_storage(func, *args, **kwargs):
+    """Run a blocking MinIO call on the storage pool, keeping the DB thread free"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        _storage_executor, functools.partial(func, *args, **kwargs)
+    )
+
+
+def can_stream_to_storage():
+    """Whether files can be uploaded to the storage while they are downloaded"""
+    return _get_minio_storage() is not None
+
+
+class _ChunkStream:
+    """File-like object read by MinIO in a storage thread and fed with chunks from the event loop"""
+
+    def __init__(self, loop, max_chunks=8):
+        self._loop = loop
+        self._chunks = queue.Queue(max_chunks)
+        # Set by the reader after taking a chunk, wakes feed() when the queue was full
+        self._space = asyncio.Event()
+        self._buffer = bytearray()
+        self._eof = False
+        self._closed = False
+        self._aborted = False
+
+    async def feed(self, chunk):
+        """Queue a chunk (None for end of stream), False once the reader has gone away"""
+        while not self._closed:
+            try:
+                self._chunks.put_nowait(chunk)
+                return True
+            except queue.Full:
+                self._space.clear()
+                # The reader may have made room before the clear, only wait if it didn't
+                if self._chunks.full():
+                    await self._space.wait()
+        return False
+
+    def close(self):
+        self._closed = True
+        self._space.set()
+
+    def abort(self):
+        self._aborted = True
+
+    def _signal_space(self):
+        try:
+            self._loop.call_soon_threadsafe(self._space.set)
+        except RuntimeError:
+            # The loop is closed, nobody is feeding anymore
+            pass
+
+    def read(self, size=-1):
+        while not self._eof and (size < 0 or len(self._buffer) < size):
+            try:
+                chunk = self._chunks.get(timeout=1)
+            except queue.Empty:
+                if self._aborted:
+                    raise IOError("Upload stream aborted")
+                continue
+            self._signal_space()
+            if chunk is None:
+                self._eof = True
+            else:
+                self._buffer += chunk
+        if size < 0:
+            size = len(self._buffer)
+        data = bytes(self._buffer[:size])
+        del self._buffer[:size]
+        return data
+
+
+async def save_stream_to_db(
+    user, file_name, chunks, length, file_size, mime_type, file_unique_id=None
+):
+    """Upload an async iterator of chunks to MinIO as they arrive and save the file record"""
+    storage = _get_minio_storage()
+    mime_type = mime_type or "application/octet-stream"
+    object_name = await _run_storage(_new_object_name, storage, file_name)
+
+    loop = asyncio.get_running_loop()
+    stream = _ChunkStream(loop)
+    upload = loop.run_in_executor(
+        _storage_executor,
+        functools.partial(
+            storage.client.put_object,
+            storage.bucket,
+            object_name,
+            stream,
+            length,
+            content_type=mime_type,
+        ),
+    )
+    upload.add_done_callback(lambda _: stream.close())
+    try:
+        async for chunk in chunks:
+            if not await stream.feed(chunk):
+                break
+        else:
+            await stream.feed(None)
+    except BaseException:
+        stream.abort()
+        await asyncio.gather(upload, return_exceptions=True)
+        raise
+    await upload
+
+    file_manager = await db_sync_to_async(FileManager.objects.create)(
+        user=user,
+        name=file_name,
+        file=object_name,
+        file_size=file_size,
+        file_mime_type=mime_type,
+        file_unique_id=file_unique_id,
+    )
+    logger.info("File streamed to storage: %s (%.2fMB)", file_name, file_size)
+    return file_manager
+
+
+@db_sync_to_async
+def _find_stored_object(file_unique_id):
+    return (
+        FileManager.objects.filter(file_unique_id=file_unique_id)
+        .values_list("file", flat=True)
+        .first()
+    )
+
+
+def _copy_object(storage, file_name, source_name):
+    from minio.commonconfig import CopySource
+
+    object_name = _new_object_name(storage, file_name)
+    storage.client.copy_object(
+        storage.bucket, object_name, CopySource(storage.bucket, source_name)
+    )
+    return object_name
+
+
+async def copy_stored_file(user, file_name, file_unique_id, file_size, mime_type):
+    """Save a file already in storage with a server-side copy, None if there's no copy to reuse"""
+    storage = _get_minio_storage()
+    if storage is None or not file_unique_id:
+        return None
+    source_name = await _find_stored_object(file_unique_id)
+    if not source_name:
+        return None
+
+    try:
+        object_name = await _run_storage(_copy_object, storage, file_name, source_name)
+    except Exception as e:
+        logger.warning("Could not reuse stored copy of %s: %s", file_name, e)
+        return None
+
+    file_manager = await db_sync_to_async(FileManager.objects.create)(
+        user=user,
+        name=file_name,
+        file=object_name,
+        file_size=file_size,
+        file_mime_type=mime_type or "application/octet-stream",
+        file_unique_id=file_unique_id,
+    )
+    logger.info("File reused from storage: %s (%.2fMB)", file_name, file_size)
+    return file_manager
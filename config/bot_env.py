@@ -0,0 +1,49 @@
+import os
+from dataclasses import dataclass
+
+
+def _parse_admin(value):
+    """Return a numeric Telegram user ID as int, anything else as a username"""
+    value = value.strip().lstrip("@")
+    return int(value) if value.isdigit() else value
+
+
+@dataclass(frozen=True, slots=True)
+class BotEnv:
+    """Telegram bot credentials, read from the environment once"""
+
+    token: str
+    api_id: int
+    api_hash: str
+    # Keep the Pyrogram session in memory and persist it to Redis instead of SQLite
+    in_memory_session: bool
+    # Recipient of startup and premium request notifications
+    admin_user_id: int | str
+
+    @classmethod
+    def from_environ(cls):
+        return cls(
+            token=os.environ.get("TELEGRAM_BOT_API_TOKEN", ""),
+            api_id=int(os.environ.get("TELEGRAM_API_ID", "0")),
+            api_hash=os.environ.get("TELEGRAM_API_HASH", ""),
+            in_memory_session=os.environ.get("TELEGRAM_IN_MEMORY_SESSION", "False")
+            == "True",
+            admin_user_id=_parse_admin(
+                os.environ.get("TELEGRAM_ADMIN_USER_ID", "103677626")
+            ),
+        )
+
+    def validate(self):
+        if not self.token:
+            raise ValueError("❌ TELEGRAM_BOT_API_TOKEN must be set in .env file")
+        if not self.api_id or not self.api_hash:
+            raise ValueError(
+                "❌ TELEGRAM_API_ID and TELEGRAM_API_HASH must be set in .env file"
+            )
+
+    @property
+    def is_configured(self):
+        return bool(self.token and self.api_id and self.api_hash)
+
+
+ENV = BotEnv.from_environ()